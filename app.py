@@ -2,67 +2,303 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 from datetime import datetime
+from functools import partial
+from io import BytesIO
 import os
+import threading
+import time
+import uuid
+import openpyxl
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # --- 1. CONFIGURATION & FILE PATHS ---
-INVENTORY_FILE = 'inventory.xlsx'
-HISTORY_FILE = 'history.xlsx'
+INVENTORY_FILE = 'inventory.feather'
+HISTORY_FILE = 'history' # Directory of Parquet files: each transaction adds one, HISTORY_COMPACT_AT of them fold into a base file
+LEGACY_INVENTORY_FILE = 'inventory.xlsx' # Read once if no Feather store exists yet
+LEGACY_HISTORY_FILE = 'history.xlsx'
 TECH_FILE = 'Technicians.txt'
 MASTER_FILE = 'PanelID.xlsx' # Your master list
 MACHINES = ["ECP101", "ECP102", "ECP103"]
+EXCEL_ENGINE = 'calamine' # Rust xlsx reader (python-calamine), much faster than openpyxl
+INV_COLUMNS = ['Panel_ID', 'Status', 'Sub_Status', 'Location', 'Last_Updated']
+HIST_COLUMNS = ['Date', 'Panel_ID', 'Action', 'User', 'Category', 'Sub_Status', 'Comments']
+STATUSES = ["In Use", "Under Repair", "Under PM", "Damaged", "Other"]
+SUB_STATUSES = ["N/A", "To check", "Waiting Parts", "Ready to Install"]
+LOCATIONS = [*MACHINES, "Workshop"]
+# Removal reason -> (resulting Status, Sub_Status choices or None for "N/A")
+REMOVAL_TABLE = {"Repair": ("Under Repair", SUB_STATUSES[1:]), "Preventive Maintenance": ("Under PM", None),
+                 "Damaged": ("Damaged", None), "Other": ("Other", None)}
+DATE_FORMAT = "%Y-%m-%d %H:%M" # 'Date' strings in legacy history.xlsx; new rows store real timestamps
+HIST_SCHEMA = pa.schema([('Date', pa.timestamp('us')), ('Panel_ID', pa.string()), ('Action', pa.string()), ('User', pa.string()),
+                         ('Category', pa.string()), ('Sub_Status', pa.string()), ('Comments', pa.string())])
+MAX_TREND_DAYS = 366 # Beyond this many days the trend chart plots weekly totals
+HISTORY_COMPACT_AT = 32 # Transaction files kept before they are folded into one base file
 
 # --- 2. DATA ENGINE ---
 
+def file_mtime(path):
+    """Change stamp used as the cache key for a data file or dataset directory (0 if missing).
+
+    Nanosecond mtime plus size (file count for a dataset), so a rewrite inside one
+    coarse timestamp tick still produces a new key in every session.
+    """
+    if not os.path.exists(path):
+        return 0
+    stat = os.stat(path)
+    if os.path.isdir(path):
+        # The history directory is flat: every file added, renamed in or removed bumps its own mtime
+        return (stat.st_mtime_ns, len(os.listdir(path)))
+    return (stat.st_mtime_ns, stat.st_size)
+
+@st.cache_data(show_spinner=False)
+def _read_excel(path, mtime):
+    """Parses an Excel file once per on-disk version; `mtime` only keys the cache."""
+    return pd.read_excel(path, engine=EXCEL_ENGINE)
+
+@st.cache_data(show_spinner=False)
+def _read_feather(path, mtime):
+    return pd.read_feather(path)
+
+def _history_parts(path):
+    """Files holding the live history: the newest base file plus the transaction files written after it.
+
+    Files a base has folded in stay on disk until the next compaction, so a read that listed
+    them just before never finds them gone; they are skipped here instead.
+    """
+    names = sorted(n for n in os.listdir(path) if n.endswith('.parquet'))
+    bases = [n for n in names if n.endswith('.base.parquet')]
+    cutoff = bases[-1].split('.')[0] if bases else ''
+    live = bases[-1:] + [n for n in names if not n.endswith('.base.parquet') and n.split('.')[0] > cutoff]
+    return [os.path.join(path, n) for n in live]
+
+@st.cache_data(show_spinner=False)
+def _read_history(path, mtime):
+    tables = [pq.read_table(p, schema=HIST_SCHEMA) for p in _history_parts(path)]
+    return (pa.concat_tables(tables) if tables else HIST_SCHEMA.empty_table()).to_pandas()
+
+@st.cache_data(show_spinner=False)
+def _read_lines(path, mtime):
+    """Reads the non-empty lines of a text file once per on-disk version."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line for line in (raw.strip() for raw in f) if line]
+
+@st.cache_resource(show_spinner=False, max_entries=2)
+def _read_master(path, mtime):
+    """Parses and cleans the master ID list once per on-disk version of the file.
+
+    Kept as a shared resource: the frozenset is immutable, so every session can use
+    the same object instead of unpickling a copy on each rerun.
+    """
+    df = pd.read_excel(path, engine=EXCEL_ENGINE)
+    # Clean the column: remove spaces and make uppercase (Arrow string kernels, no per-cell Python objects)
+    return frozenset(df['Panel_ID'].astype('string[pyarrow]').str.strip().str.upper().dropna().unique())
+
 def load_master_list():
-    """Reads the authorized Panel IDs from the Master Excel file."""
+    """Reads the authorized Panel IDs from the Master Excel file as a frozenset."""
     if os.path.exists(MASTER_FILE):
-        df = pd.read_excel(MASTER_FILE)
-        # Clean the column: remove spaces and make uppercase
-        return df['Panel_ID'].astype(str).str.strip().str.upper().tolist()
+        return _read_master(MASTER_FILE, file_mtime(MASTER_FILE))
     else:
         st.error(f"⚠️ {MASTER_FILE} missing! Please create it with a 'Panel_ID' column.")
-        return []
+        return frozenset()
 
 def load_technicians():
     if not os.path.exists(TECH_FILE):
         with open(TECH_FILE, 'w') as f: f.write("Admin\nAnand")
-    with open(TECH_FILE, 'r') as f:
-        return [line.strip() for line in f.readlines() if line.strip()]
+    return _read_lines(TECH_FILE, file_mtime(TECH_FILE))
+
+def as_category(series, known=()):
+    """Casts a low-cardinality text column to Categorical; `known` values stay assignable."""
+    return series.astype(pd.CategoricalDtype(list(dict.fromkeys([*known, *series.dropna().unique()]))))
+
+def _load_table(path, legacy_path, columns):
+    """Reads a Feather store, falling back to its legacy .xlsx copy until the first save."""
+    if os.path.exists(path):
+        return _read_feather(path, file_mtime(path))
+    if os.path.exists(legacy_path):
+        return _read_excel(legacy_path, file_mtime(legacy_path))
+    return pd.DataFrame(columns=columns)
+
+@st.cache_data(show_spinner=False)
+def _load_inventory(mtime, legacy_mtime):
+    """Cleaned inventory indexed by Panel_ID, rebuilt only when the store changes."""
+    df_inv = _load_table(INVENTORY_FILE, LEGACY_INVENTORY_FILE, INV_COLUMNS)
+    df_inv['Panel_ID'] = df_inv['Panel_ID'].astype('string[pyarrow]').str.strip().str.upper()
+    if 'Sub_Status' not in df_inv.columns: df_inv['Sub_Status'] = "N/A"
+    df_inv['Sub_Status'] = as_category(df_inv['Sub_Status'].fillna("N/A"), SUB_STATUSES) # Excel reads "N/A" back as NaN
+    df_inv['Status'] = as_category(df_inv['Status'], STATUSES)
+    df_inv['Location'] = as_category(df_inv['Location'], LOCATIONS)
+    # Panel_ID doubles as the (hashed) index so lookups and updates are label-based, not mask scans
+    return df_inv.drop_duplicates('Panel_ID', keep='last').set_index('Panel_ID', drop=False).rename_axis(None)
 
 def load_db():
-    """Loads the live tracking and history files."""
-    if not os.path.exists(INVENTORY_FILE):
-        df_inv = pd.DataFrame(columns=['Panel_ID', 'Status', 'Sub_Status', 'Location', 'Last_Updated'])
-    else:
-        df_inv = pd.read_excel(INVENTORY_FILE)
-        df_inv['Panel_ID'] = df_inv['Panel_ID'].astype(str).str.strip().str.upper()
-        if 'Sub_Status' not in df_inv.columns: df_inv['Sub_Status'] = "N/A"
+    """Loads the live tracking and history files (cached until they change on disk)."""
+    df_inv = _load_inventory(file_mtime(INVENTORY_FILE), file_mtime(LEGACY_INVENTORY_FILE))
 
-    if not os.path.exists(HISTORY_FILE):
-        df_hist = pd.DataFrame(columns=['Date', 'Panel_ID', 'Action', 'User', 'Category', 'Sub_Status', 'Comments'])
+    if os.path.exists(HISTORY_FILE):
+        df_hist = _read_history(HISTORY_FILE, file_mtime(HISTORY_FILE))
+    elif os.path.exists(LEGACY_HISTORY_FILE):
+        df_hist = _read_excel(LEGACY_HISTORY_FILE, file_mtime(LEGACY_HISTORY_FILE))
     else:
-        df_hist = pd.read_excel(HISTORY_FILE)
+        df_hist = pd.DataFrame(columns=HIST_COLUMNS)
+    if not pd.api.types.is_datetime64_any_dtype(df_hist['Date']):
+        # Only a legacy Excel log still holds date strings; the Parquet store round-trips timestamps
+        df_hist['Date'] = pd.to_datetime(df_hist['Date'], format=DATE_FORMAT, cache=True)
+    # Sorted once per reload (get_db keeps the result), whatever order the store returned rows in
+    df_hist = df_hist.sort_values('Date', kind='stable', ignore_index=True)
+    df_hist['Date_Only'] = df_hist['Date'].dt.floor('D')
+    for c in ['Action', 'Category', 'User']: df_hist[c] = as_category(df_hist[c])
+    for c in ['Panel_ID', 'Comments']: df_hist[c] = df_hist[c].astype('string[pyarrow]')
     return df_inv, df_hist
 
-def save_db(df_inv, df_hist):
-    df_inv.to_excel(INVENTORY_FILE, index=False)
-    df_hist.to_excel(HISTORY_FILE, index=False)
+def get_db():
+    """Session copy of (df_inv, df_hist), reloaded only when a store file changes."""
+    key = (file_mtime(INVENTORY_FILE), file_mtime(LEGACY_INVENTORY_FILE), file_mtime(HISTORY_FILE),
+           file_mtime(LEGACY_HISTORY_FILE))
+    if st.session_state.get('db_key') != key:
+        st.session_state.db, st.session_state.db_key = load_db(), key
+    return st.session_state.db
+
+def save_inventory(df_inv):
+    # Write beside the live file and swap it in, so other sessions never read a half-written snapshot
+    tmp = f"{INVENTORY_FILE}.{uuid.uuid4().hex}.tmp"
+    df_inv.reset_index(drop=True).to_feather(tmp, compression='zstd')
+    os.replace(tmp, INVENTORY_FILE)
+    # Clear both layers: _load_inventory would otherwise be refilled from _read_feather's stale entry
+    _read_feather.clear()
+    _load_inventory.clear()
+
+def _write_history_table(table, name):
+    # Written under a temp name and renamed in, so readers never pick up a half-written file
+    os.makedirs(HISTORY_FILE, exist_ok=True)
+    tmp = os.path.join(HISTORY_FILE, f"{uuid.uuid4().hex}.tmp")
+    pq.write_table(table, tmp)
+    os.replace(tmp, os.path.join(HISTORY_FILE, name))
+
+def _write_history_rows(df):
+    """Adds rows to the history as one new Parquet file."""
+    df = df.reindex(columns=HIST_COLUMNS)
+    df['Date'] = pd.to_datetime(df['Date'], format=DATE_FORMAT)
+    for c in HIST_COLUMNS[1:]: df[c] = df[c].astype('string[pyarrow]')
+    # Zero-padded ns time stamps keep the file names (and thus row order) chronological
+    _write_history_table(pa.Table.from_pandas(df, schema=HIST_SCHEMA, preserve_index=False), f"{time.time_ns():020d}.parquet")
+
+def _compact_history():
+    """Folds the live history files into one base file named after the newest of them."""
+    parts = _history_parts(HISTORY_FILE)
+    # Only now delete what the previous base folded in; this round's inputs wait for the next one
+    for name in os.listdir(HISTORY_FILE):
+        if name.endswith('.parquet') and os.path.join(HISTORY_FILE, name) not in parts:
+            os.remove(os.path.join(HISTORY_FILE, name))
+    merged = pa.concat_tables([pq.read_table(p, schema=HIST_SCHEMA) for p in parts])
+    _write_history_table(merged, os.path.basename(parts[-1]).split('.')[0] + '.base.parquet')
+
+def append_history(log):
+    """Appends one transaction to the history instead of rewriting the whole log."""
+    if not os.path.exists(HISTORY_FILE) and os.path.exists(LEGACY_HISTORY_FILE):
+        # First write: carry over the legacy Excel log as a single file
+        _write_history_rows(_read_excel(LEGACY_HISTORY_FILE, file_mtime(LEGACY_HISTORY_FILE)))
+    _write_history_rows(pd.DataFrame([log]))
+    # Bound the file count, since reading many small files costs far more than reading one
+    if len(_history_parts(HISTORY_FILE)) > HISTORY_COMPACT_AT:
+        _compact_history()
+    _read_history.clear()
+
+@st.cache_resource
+def _write_lock():
+    """One lock per server process, so sessions apply their transactions one at a time."""
+    return threading.Lock()
+
+def record_transaction(pid, values, log):
+    """Persists one transaction: the panel's new (Status, Sub_Status, Location, Last_Updated) and its log row.
+
+    The inventory is taken from the store, not the caller's frame: inside the operations
+    fragment that frame dates from the last full run and can miss other sessions' saves.
+    """
+    with _write_lock():
+        df_inv = _load_inventory(file_mtime(INVENTORY_FILE), file_mtime(LEGACY_INVENTORY_FILE))
+        if pid in df_inv.index:
+            df_inv.loc[pid, INV_COLUMNS[1:]] = list(values)
+        else:
+            # New Entry: cast to the inventory's dtypes first, since enlargement via .loc would turn the
+            # categorical Status/Sub_Status/Location columns back into strings (in memory and in the Feather file)
+            new_row = pd.DataFrame([[pid, *values]], columns=INV_COLUMNS, index=[pid]).astype(df_inv.dtypes.to_dict())
+            df_inv = pd.concat([df_inv, new_row])
+        save_inventory(df_inv)
+        append_history(log)
+    for builder in (build_fleet_pie, build_repair_bar, build_trend_chart): builder.clear() # Drop figures built for superseded data
+
+def to_excel_bytes(df):
+    """Serializes a frame to .xlsx in memory; only run when an export is requested.
+
+    Uses an openpyxl write-only workbook, which streams rows instead of building
+    a styled cell object per value like `DataFrame.to_excel` does.
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(list(df.columns))
+    for row in df.astype(object).where(df.notna(), None).itertuples(index=False, name=None):
+        ws.append(row)
+    buf = BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def to_csv_bytes(df):
+    return df.to_csv(index=False).encode('utf-8')
+
+# Chart builders: `signature` is the cache key; the underscore argument is not hashed by Streamlit.
+# cache_resource hands back the same Figure object instead of unpickling a copy on every hit.
+def frame_signature(df, time_col):
+    """Cheap change marker for a frame: row count plus newest timestamp (every write stamps one)."""
+    return (len(df), str(df[time_col].max()) if len(df) else '')
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def build_fleet_pie(status_counts):
+    """Fleet-health pie from pre-aggregated ((status, count), ...) pairs, so Plotly never scans the frame."""
+    counts = pd.DataFrame(status_counts, columns=['Status', 'count'])
+    return px.pie(counts, names='Status', values='count', color='Status',
+                  color_discrete_map={"In Use":"#2ecc71", "Under Repair":"#e74c3c", "Under PM":"#f1c40f", "Damaged":"#9b59b6"})
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def build_repair_bar(sub_status_counts):
+    """Sub-status bar for the repair queue from pre-aggregated ((sub_status, count), ...) pairs."""
+    counts = pd.DataFrame(sub_status_counts, columns=['Sub_Status', 'count'])
+    return px.bar(counts, x='Sub_Status', y='count', color='Sub_Status', title="Maintenance Status")
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def build_trend_chart(signature, _df_hist):
+    # Trend Chart: Removal Category by Day (by week once the history spans more than MAX_TREND_DAYS days)
+    removals = _df_hist[_df_hist['Action'].eq("Remove from Machine")]
+    bucket = 'Date_Only'
+    if removals['Date_Only'].nunique() > MAX_TREND_DAYS:
+        removals = removals.assign(Week=removals['Date'].dt.to_period('W').dt.start_time)
+        bucket = 'Week'
+    trend = removals.groupby([bucket, 'Category'], observed=True, sort=True).size().reset_index(name='Count')
+    # WebGL (scattergl) traces keep pan/zoom smooth on long histories
+    return px.line(trend, x=bucket, y='Count', color='Category', markers=True, render_mode='webgl',
+                   title="Failure Source Trends (CSS vs Tape)")
 
 # --- 3. UI INITIALIZATION ---
 st.set_page_config(layout="wide", page_title="Panel Holder Tracking System")
-master_ids = load_master_list()
+master_ids = load_master_list() # frozenset: O(1) membership for the per-keystroke check
 tech_names = load_technicians()
-df_inv, df_hist = load_db()
+df_inv, df_hist = get_db()
 
 st.title("Panel Holder Tracking System")
 
 # --- 4. MANAGEMENT KPI BAR ---
 kpi = st.columns(5)
 total_in_master = len(master_ids)
-in_use = len(df_inv[df_inv['Status'] == 'In Use'])
-repair = len(df_inv[df_inv['Status'] == 'Under Repair'])
-pm = len(df_inv[df_inv['Status'] == 'Under PM'])
-damaged = len(df_inv[df_inv['Status'] == 'Damaged'])
+# One groupby over Status feeds every KPI, the fleet pie and the repair queue
+status_groups = df_inv.groupby('Status', observed=True, sort=False)
+status_counts = status_groups.size()
+# Repair pipeline counts come from the same groupby, without copying out the 'Under Repair' rows
+sub_status_counts = status_groups['Sub_Status'].value_counts()
+repair_counts = sub_status_counts.xs('Under Repair').loc[lambda c: c > 0] if 'Under Repair' in status_counts.index else sub_status_counts.iloc[:0]
+in_use = int(status_counts.get('In Use', 0))
+repair = int(status_counts.get('Under Repair', 0))
+pm = int(status_counts.get('Under PM', 0))
+damaged = int(status_counts.get('Damaged', 0))
 
 kpi[0].metric("Total Fleet", total_in_master)
 kpi[1].metric("🟢 In Use", in_use)
@@ -73,93 +309,86 @@ kpi[4].metric("⚠️ Damaged", damaged)
 st.divider()
 
 # --- 5. OPERATIONS SECTION ---
-col_id, col_action = st.columns([1, 1.2])
+# Runs as a fragment: scanning, verifying and filling in the form rerun only this panel,
+# not the KPI bar and charts. A commit still triggers a full rerun so those refresh.
+@st.fragment
+def operations_panel(df_inv, master_ids, tech_names):
+    col_id, col_action = st.columns([1, 1.2])
 
-with col_id:
-    st.subheader("1. Identify Agent & Asset")
-    selected_tech = st.selectbox("Select Technician", options=tech_names)
+    with col_id:
+        st.subheader("1. Identify Agent & Asset")
+        selected_tech = st.selectbox("Select Technician", options=tech_names)
     
-    # Input cleaning (Case insensitive and no spaces)
-    raw_pid = st.text_input("Scan or Type Panel ID").strip().upper()
+        # Validate on Enter / Verify only, not on every keystroke (scanners send Enter after the ID)
+        with st.form("id_form"):
+            # Input cleaning (Case insensitive and no spaces)
+            raw_pid = st.text_input("Scan or Type Panel ID").strip().upper()
+            st.form_submit_button("Verify")
     
-    is_valid = False
-    if raw_pid:
-        if raw_pid in master_ids:
-            is_valid = True
-            st.success(f"✅ ID Verified: {raw_pid}")
-            # Check current status from live inventory
-            current_data = df_inv[df_inv['Panel_ID'] == raw_pid]
-            if not current_data.empty:
-                row = current_data.iloc[0]
-                st.info(f"Current State: {row['Status']} at {row['Location']}")
+        is_valid = False
+        if raw_pid:
+            if raw_pid in master_ids:
+                is_valid = True
+                st.success(f"✅ ID Verified: {raw_pid}")
+                # Check current status from live inventory
+                if raw_pid in df_inv.index:
+                    row = df_inv.loc[raw_pid]
+                    st.info(f"Current State: {row['Status']} at {row['Location']}")
+                else:
+                    st.warning("First time scan. This ID is currently in 'Storage'.")
             else:
-                st.warning("First time scan. This ID is currently in 'Storage'.")
-        else:
-            st.error(f"❌ INVALID ID: '{raw_pid}' is not in the Master List (PanelID.xlsx).")
+                st.error(f"❌ INVALID ID: '{raw_pid}' is not in the Master List (PanelID.xlsx).")
 
-with col_action:
-    st.subheader("2. Execute Action")
-    if not is_valid:
-        st.write("⬅️ *Enter a valid Panel ID to unlock actions.*")
-    else:
-        op_type = st.radio("Activity Type:", ["Install to Machine", "Remove from Machine"], horizontal=True)
+    with col_action:
+        st.subheader("2. Execute Action")
+        if not is_valid:
+            st.write("⬅️ *Enter a valid Panel ID to unlock actions.*")
+        else:
+            op_type = st.radio("Activity Type:", ["Install to Machine", "Remove from Machine"], horizontal=True)
         
-        with st.form("action_form"):
-            category = "Production"
-            if op_type == "Install to Machine":
-                final_loc = st.selectbox("Install into:", MACHINES)
-                final_status = "In Use"
-                final_sub = "N/A"
-            else:
-                # REMOVAL LOGIC
-                final_loc = "Workshop"
-                reason_main = st.selectbox("Reason for Removal:", ["Repair", "Preventive Maintenance", "Damaged", "Other"])
-                category = st.selectbox("Failure Category:", ["CSS", "Tape", "Other"])
+            with st.form("action_form"):
+                category = "Production"
+                if op_type == "Install to Machine":
+                    final_loc = st.selectbox("Install into:", MACHINES)
+                    final_status = "In Use"
+                    final_sub = "N/A"
+                else:
+                    # REMOVAL LOGIC
+                    final_loc = "Workshop"
+                    reason_main = st.selectbox("Reason for Removal:", list(REMOVAL_TABLE))
+                    category = st.selectbox("Failure Category:", ["CSS", "Tape", "Other"])
                 
-                # Dynamic Logic for 'Other' and 'Repair'
-                other_comment = ""
-                if category == "Other":
-                    other_comment = st.text_input("Describe 'Other' Category:")
+                    # Dynamic Logic for 'Other' and 'Repair'
+                    other_comment = ""
+                    if category == "Other":
+                        other_comment = st.text_input("Describe 'Other' Category:")
                 
-                if reason_main == "Repair":
-                    final_sub = st.selectbox("Repair Status:", ["To check", "Waiting Parts", "Ready to Install"])
-                    final_status = "Under Repair"
-                elif reason_main == "Preventive Maintenance":
-                    final_status = "Under PM"; final_sub = "N/A"
-                elif reason_main == "Damaged":
-                    final_status = "Damaged"; final_sub = "N/A"
-                else:
-                    final_status = "Other"; final_sub = "N/A"
+                    final_status, sub_options = REMOVAL_TABLE[reason_main]
+                    final_sub = st.selectbox("Repair Status:", sub_options) if sub_options else "N/A"
 
-            notes = st.text_area("Observations / Comments")
+                notes = st.text_area("Observations / Comments")
             
-            if st.form_submit_button("COMMIT TRANSACTION"):
-                # Clean comments
-                full_comment = f"[{category}] {other_comment} | {notes}" if category == "Other" else f"[{category}] {notes}"
+                if st.form_submit_button("COMMIT TRANSACTION"):
+                    now = datetime.now() # One timestamp so the log row and Last_Updated agree
+                    # Clean comments
+                    full_comment = f"[{category}] {other_comment} | {notes}" if category == "Other" else f"[{category}] {notes}"
                 
-                # Update Snapshot (Digital Twin)
-                if raw_pid in df_inv['Panel_ID'].values:
-                    df_inv.loc[df_inv['Panel_ID'] == raw_pid, ['Status', 'Sub_Status', 'Location', 'Last_Updated']] = [final_status, final_sub, final_loc, datetime.now()]
-                else:
-                    # New Entry
-                    new_row = {'Panel_ID': raw_pid, 'Status': final_status, 'Sub_Status': final_sub, 'Location': final_loc, 'Last_Updated': datetime.now()}
-                    df_inv = pd.concat([df_inv, pd.DataFrame([new_row])], ignore_index=True)
-
-                # Log to History for Trends
-                new_log = {
-                    'Date': datetime.now().strftime("%Y-%m-%d %H:%M"),
-                    'Panel_ID': raw_pid,
-                    'Action': op_type,
-                    'User': selected_tech,
-                    'Category': category,
-                    'Sub_Status': final_sub,
-                    'Comments': full_comment
-                }
-                df_hist = pd.concat([df_hist, pd.DataFrame([new_log])], ignore_index=True)
-                
-                save_db(df_inv, df_hist)
-                st.toast(f"Updated {raw_pid} successfully!")
-                st.rerun()
+                    # Log to History for Trends
+                    new_log = {
+                        'Date': now,
+                        'Panel_ID': raw_pid,
+                        'Action': op_type,
+                        'User': selected_tech,
+                        'Category': category,
+                        'Sub_Status': final_sub,
+                        'Comments': full_comment
+                    }
+                    # Save the Snapshot (Digital Twin) update and the log row before confirming
+                    record_transaction(raw_pid, (final_status, final_sub, final_loc, now), new_log)
+                    st.toast(f"Updated {raw_pid} successfully!")
+                    st.rerun()
+
+operations_panel(df_inv, master_ids, tech_names)
 
 st.divider()
 
@@ -171,25 +400,28 @@ with tab1:
     c1, c2 = st.columns(2)
     with c1:
         st.write("**Total Fleet Health**")
-        fig_pie = px.pie(df_inv, names='Status', color='Status', 
-                         color_discrete_map={"In Use":"#2ecc71", "Under Repair":"#e74c3c", "Under PM":"#f1c40f", "Damaged":"#9b59b6"})
-        st.plotly_chart(fig_pie, use_container_width=True)
+        st.plotly_chart(build_fleet_pie(tuple(status_counts.items())), use_container_width=True)
     with c2:
         st.write("**Repair Queue Pipeline**")
-        rep_df = df_inv[df_inv['Status'] == 'Under Repair']
-        if not rep_df.empty:
-            fig_sub = px.bar(rep_df['Sub_Status'].value_counts().reset_index(), x='Sub_Status', y='count', color='Sub_Status', title="Maintenance Status")
-            st.plotly_chart(fig_sub, use_container_width=True)
+        if not repair_counts.empty:
+            st.plotly_chart(build_repair_bar(tuple(repair_counts.items())), use_container_width=True)
         else: st.info("No items in Repair pipeline.")
 
 with tab2:
     if not df_hist.empty:
-        df_hist['Date_Only'] = pd.to_datetime(df_hist['Date']).dt.date
-        # Trend Chart: Removal Category by Day
-        trend = df_hist[df_hist['Action'] == "Remove from Machine"].groupby(['Date_Only', 'Category']).size().reset_index(name='Count')
-        fig_trend = px.line(trend, x='Date_Only', y='Count', color='Category', markers=True, title="Failure Source Trends (CSS vs Tape)")
-        st.plotly_chart(fig_trend, use_container_width=True)
+        st.plotly_chart(build_trend_chart(frame_signature(df_hist, 'Date'), df_hist), use_container_width=True)
     else: st.info("No history logs available yet.")
 
 with tab3:
-    st.dataframe(df_hist.sort_values(by='Date', ascending=False), use_container_width=True)
+    # load_db sorts history by Date, so newest-first is a reversed view rather than a sort
+    st.dataframe(df_hist.iloc[::-1], use_container_width=True)
+
+
+# --- 7. EXPORT ---
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+with st.sidebar:
+    st.subheader("📥 Export")
+    # Callables are only evaluated on click, keeping Excel serialization off the rerun path
+    st.download_button("Download Inventory (.xlsx)", partial(to_excel_bytes, df_inv), file_name=LEGACY_INVENTORY_FILE, mime=XLSX_MIME)
+    st.download_button("Download History Log (.xlsx)", partial(to_excel_bytes, df_hist), file_name=LEGACY_HISTORY_FILE, mime=XLSX_MIME)
+    st.download_button("Download History Log (.csv)", partial(to_csv_bytes, df_hist), file_name="history.csv", mime="text/csv")